@@ -1,140 +1,386 @@
 """dns_explorer.py - Exploration DNS couche par couche (avec parents)"""
 
 import re
+import time
+import asyncio
 import argparse
+import ipaddress
+import dns.asyncresolver
+import dns.exception
 import dns.resolver
 import dns.reversename
-from dns_graph import draw_dns_graph
+from dns_graph import (draw_dns_graph, draw_dns_graph_in_background, window_will_open,
+                       EXPORT_FORMATS, DEFAULT_EXPORT_FORMATS)
+
+"""types demandés pour tout les domaines, et ceux qu'on demande seulement pour un apex de zone
+(PTR, SRV et CAA passent en plus par _should_query qui vire les noms où sa peut pas exister)"""
+COMMON_RECORD_TYPES = ["A", "AAAA", "CNAME", "MX", "NS", "TXT", "PTR", "SRV"]
+APEX_RECORD_TYPES = ["SOA", "CAA"]
+REVERSE_ZONES = (".in-addr.arpa", ".ip6.arpa")
+
+"""nombre max de requetes DNS en vol en même temps dans une couche (tout domaines et types confondus)"""
+MAX_CONCURRENT_QUERIES = 128
+
+"""cache des résolutions: (domaine, timeout) -> (date d'expiration, enregistrements)
+sa évite de refaire les mêmes requetes quand plusieurs domaines ont le même parent/NS"""
+CACHE_TTL = 300
+CACHE_MAX_SIZE = 4096
+_CACHE = {}
+
+"""cache de extract_domains_from_records: (enregistrements, PTR) -> domaines trouvés"""
+_EXTRACT_CACHE = {}
+
+"""regex pour les domaines cités dans les SPF (include:xxx et redirect=xxx), compilée une seule fois"""
+_SPF_TARGET_RE = re.compile(r'(?:include:|redirect=)([^\s"]+)')
+
+"""erreurs qui veulent dire "pas de réponse à temps" (et pas "pas d'enregistrement")"""
+_TIMEOUT_ERRORS = (asyncio.TimeoutError, dns.exception.Timeout)
+
+"""resolver partagé, créé au premier appel de get_resolver, et les serveurs DNS
+du système qu'il avait a sa création (pour y revenir avec set_nameservers(None))"""
+_RESOLVER = None
+_SYSTEM_NAMESERVERS = None
+
+
+def get_resolver(timeout=3):
+    """Renvoie le resolver partagé par toutes les requetes
+    on le crée une seule fois (sa relit /etc/resolv.conf a chaque création)
+    et on change juste le timeout si il est différent
+    il garde aussi les réponses en cache (selon leur TTL) pour pas redemander
+    la même chose au serveur, genre le PTR d'une IP partagée par plein de domaines"""
+    global _RESOLVER, _SYSTEM_NAMESERVERS
+    if _RESOLVER is None:
+        _RESOLVER = dns.asyncresolver.Resolver()
+        _RESOLVER.cache = dns.resolver.Cache()
+        _SYSTEM_NAMESERVERS = list(_RESOLVER.nameservers)
+    if _RESOLVER.timeout != timeout or _RESOLVER.lifetime != timeout:
+        _RESOLVER.timeout = timeout
+        _RESOLVER.lifetime = timeout
+    return _RESOLVER
+
+
+def set_nameservers(nameservers):
+    """Force le resolver partagé a interroger ces serveurs DNS (ex: ["1.1.1.1"])
+    au lieu de ceux du système, toutes les requetes partent alors vers le même serveur
+    None (ou une liste vide) remet ceux du système
+    si les serveurs changent on vide les caches, un autre serveur peut répondre autre chose"""
+    resolver = get_resolver()
+    nameservers = list(nameservers) if nameservers else list(_SYSTEM_NAMESERVERS)
+    if [str(ns) for ns in resolver.nameservers] == [str(ns) for ns in nameservers]:
+        return
+    resolver.nameservers = nameservers
+    resolver.cache.flush()
+    _CACHE.clear()
+
 
 def get_parent_domain(domain):
     """Cette fonction récupère le domaine parent
     par exemple si on a "sub.exemple.com" elle renvoi "exemple.com"
-    c'est pratique pour remonter dans la hierarchie"""
-    parts = domain.split(".")
-    if len(parts) > 2:
-        return ".".join(parts[1:])
-    return None
+    c'est pratique pour remonter dans la hierarchie
+    (on coupe juste après le premier point, sans passer par split/join)"""
+    i = domain.find(".")
+    if i == -1:
+        return None
+    rest = domain[i + 1:]
+    return rest if "." in rest else None
 
 
-def resolve_all_records(domain, timeout=3):
-    """Ici on fait toutes les requetes DNS possible sur un domaine
-    genre A, AAAA, MX, NS etc... sa permet de tout récupérer d'un coup"""
-    record_types = ["A", "AAAA", "CNAME", "MX", "NS", "TXT", "SOA","PTR","CAA","SRV"]
+def _normalize_answers(rtype, answers):
+    """Transforme les réponses en textes normalisés une bonne fois pour toute
+    (point final enlevé + minuscules) comme sa on a plus a le refaire après
+    les TXT on les laisse tel quel vu que la casse compte dedans"""
+    if rtype == "TXT":
+        return tuple(answer.to_text() for answer in answers)
+    return tuple(answer.to_text().rstrip(".").lower() for answer in answers)
+
+
+async def _query(resolver, qname, rtype, timeout, sem=None, started=None):
+    """Une seule requete DNS bornée par le timeout
+    si on donne un sémaphore elle attend une place libre avant de partir
+    started (un asyncio.Event) est levé dès que la requete a sa place"""
+    if sem is None:
+        return await asyncio.wait_for(resolver.resolve(qname, rtype), timeout)
+    async with sem:
+        if started is not None:
+            started.set()
+        return await asyncio.wait_for(resolver.resolve(qname, rtype), timeout)
+
+
+async def _resolve_types(resolver, domain, record_types, timeout, deadline, sem=None):
+    """Lance les requetes pour une liste de types en même temps, chacune bornée par le timeout
+    et le tout par la deadline, renvoie (enregistrements, True si tout a fini à temps,
+    temps passé depuis le départ de la deadline)"""
     results = {}
+    if not record_types:
+        return results, True, 0.0
+    
+    started = asyncio.Event()
+    tasks = {
+        rtype: asyncio.ensure_future(_query(resolver, domain, rtype, timeout, sem, started))
+        for rtype in record_types
+    }
+    
+    """la deadline part seulement quand une première requete du domaine a une place
+    dans le sémaphore, sinon dans une grosse couche les derniers domaines passaient
+    leur deadline a attendre leur tour et revenaient vides"""
+    if sem is not None:
+        await started.wait()
+    clock = time.monotonic()
+    done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    
+    """deadline dépassée -> on annule les requetes qui traînent encore"""
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    
+    """on remet tout dans le dict, une exception = pas d'enregistrement de ce type
+    sauf un timeout : là on sait juste pas, donc le résultat compte comme incomplet"""
+    complete = not pending
+    for rtype, task in tasks.items():
+        if task not in done:
+            continue
+        error = task.exception()
+        if error is not None:
+            if isinstance(error, _TIMEOUT_ERRORS):
+                complete = False
+            continue
+        results[rtype] = _normalize_answers(rtype, task.result())
     
-    """on crée le resolver avec un timeout pour pas attendre trop longtemps"""
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
-    
-    """on boucle sur chaque type et on essaye de résoudre"""
-    for rtype in record_types:
-        try:
-            answers = resolver.resolve(domain, rtype)
-            results[rtype] = [answer.to_text() for answer in answers]
-        except:
-            pass
-    
+    return results, complete, time.monotonic() - clock
+
+
+def _should_query(domain, rtype):
+    """Dit si sa vaut le coup de demander ce type pour ce domaine
+    sinon on attend une réponse vide (ou le timeout) pour rien"""
+    name = domain.rstrip(".")
+    """PTR -> seulement sur les noms reverse (in-addr.arpa / ip6.arpa)"""
+    if rtype == "PTR":
+        return name.endswith(REVERSE_ZONES)
+    """SRV -> seulement sur les noms de service genre _sip._tcp.exemple.com"""
+    if rtype == "SRV":
+        return name.startswith("_")
+    """CAA -> c'est mis a l'apex, pas sur les noms trop profonds"""
+    if rtype == "CAA":
+        return name.count(".") <= 3
+    return True
+
+
+async def resolve_all_records_async(domain, timeout=3, deadline=None, sem=None):
+    """Version asynchrone de resolve_all_records, on lance toutes les requetes
+    DNS en même temps au lieu d'attendre chaque type l'un après l'autre
+    donc on attend environ la requete la plus lente et pas la somme de toutes
+    timeout c'est le max pour une requete, deadline le max pour tout le domaine
+    (les types pas finis à la deadline sont abandonnés, on garde ceux qui ont répondu)
+    sem c'est un sémaphore partagé pour limiter les requetes en vol entre plusieurs domaines
+    si le domaine a déja été résolu il y a moins de CACHE_TTL secondes on renvoie le cache"""
+    results, _ = await _resolve_domain(domain, timeout, deadline, sem)
     return results
 
 
-def reverse_dns(ip, timeout=3):
-    """Fait un reverse DNS (PTR) sur une adresse IP
-    Retourne le nom de domaine associé ou None si pas trouvé"""
+async def _resolve_domain(domain, timeout, deadline, sem=None):
+    """Le travail de resolve_all_records_async, renvoie (enregistrements, temps déja pris
+    sur la deadline) pour que l'appelant borne ses requetes suivantes (les PTR) avec le reste"""
+    key = (domain, timeout)
+    cached = _CACHE.get(key)
+    if cached and cached[0] > time.monotonic():
+        return dict(cached[1]), 0.0
+    
+    """on reprend le resolver partagé avec un timeout pour pas attendre trop longtemps"""
+    resolver = get_resolver(timeout)
+    
+    """d'abord les types courants qui ont du sens pour ce nom"""
+    record_types = [rtype for rtype in COMMON_RECORD_TYPES if _should_query(domain, rtype)]
+    results, complete, spent = await _resolve_types(resolver, domain, record_types,
+                                                    timeout, deadline, sem)
+    
+    """SOA/CAA seulement si sa ressemble a un apex de zone (des NS et pas de CNAME)
+    la plupart des domaines trouvés sont des hôtes donc sa économise pas mal de requetes
+    (une requete en timeout empêche pas ce tour, seulement une deadline dépassée)"""
+    in_time = deadline is None or spent < deadline
+    if in_time and "NS" in results and "CNAME" not in results:
+        """la deadline compte que le temps où les requetes avaient leur place"""
+        remaining = None if deadline is None else deadline - spent
+        apex_types = [rtype for rtype in APEX_RECORD_TYPES if _should_query(domain, rtype)]
+        apex_results, apex_complete, apex_spent = await _resolve_types(
+            resolver, domain, apex_types, timeout, remaining, sem)
+        results.update(apex_results)
+        complete = complete and apex_complete
+        spent += apex_spent
+    
+    """résultat incomplet (deadline dépassée ou requete en timeout), on le met pas en cache"""
+    if not complete:
+        return results, spent
+    
+    """on garde le résultat en cache, si il est plein on vire le plus ancien"""
+    if len(_CACHE) >= CACHE_MAX_SIZE:
+        _CACHE.pop(next(iter(_CACHE)))
+    _CACHE[key] = (time.monotonic() + CACHE_TTL, results)
+    
+    return dict(results), spent
 
-    
-    resolver = dns.resolver.Resolver()
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
+
+def resolve_all_records(domain, timeout=3, deadline=None):
+    """Ici on fait toutes les requetes DNS possible sur un domaine
+    genre A, AAAA, MX, NS etc... sa permet de tout récupérer d'un coup
+    (les requetes partent en parallèle via resolve_all_records_async)"""
+    return asyncio.run(resolve_all_records_async(domain, timeout, deadline))
+
+
+async def reverse_dns_async(ip, timeout=3, sem=None, started=None):
+    """Fait un reverse DNS (PTR) sur une adresse IP sans bloquer les autres requetes
+    Retourne la liste des noms de domaine associés ou une liste vide si pas trouvé
+    sem et started comme pour _query"""
+    resolver = get_resolver(timeout)
     
     try:
         """On convertit l'IP en format reverse (in-addr.arpa ou ip6.arpa)"""
         reverse_name = dns.reversename.from_address(ip)
-        answers = resolver.resolve(reverse_name, "PTR")
-        return [answer.to_text().rstrip(".") for answer in answers]
-    except:
+        answers = await _query(resolver, reverse_name, "PTR", timeout, sem, started)
+        return [answer.to_text().rstrip(".").lower() for answer in answers]
+    except Exception:
         return []
 
 
-def extract_domains_from_records(records, current_domain):
-    """Cette fonction extrait tout les domaines qu'on trouve dans les enregistrements
-    comme sa on peut les explorer après dans les prochaines couches"""
+async def _reverse_ips(ips, timeout, deadline, sem=None):
+    """Reverse DNS de plusieurs IPs en même temps, le tout borné par la deadline
+    (qui part comme dans _resolve_types quand une première requete a sa place)
+    Retourne {ip: noms}, une IP pas finie à la deadline a une liste vide"""
+    if not ips:
+        return {}
+    
+    started = asyncio.Event()
+    tasks = {
+        ip: asyncio.ensure_future(reverse_dns_async(ip, timeout, sem, started))
+        for ip in dict.fromkeys(ips)
+    }
+    if sem is not None:
+        await started.wait()
+    done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    
+    return {ip: task.result() if task in done else [] for ip, task in tasks.items()}
+
+
+def reverse_dns(ip, timeout=3):
+    """Fait un reverse DNS (PTR) sur une adresse IP
+    Retourne le nom de domaine associé ou None si pas trouvé"""
+    return asyncio.run(reverse_dns_async(ip, timeout))
+
+
+def _parse_names(values):
+    """CNAME, NS, PTR -> la valeur c'est directement un nom de domaine (déja normalisé)"""
+    return values
+
+
+def _parse_mx(values):
+    """MX -> c'est les serveurs mails, genre "10 smtp.google.com" """
+    domains = []
+    for mx in values:
+        parts = mx.split()
+        if len(parts) >= 2:
+            domains.append(parts[1])
+    return domains
+
+
+def _parse_soa(values):
+    """SOA -> le serveur DNS primaire du domaine (premier champ)"""
+    domains = []
+    for soa in values:
+        parts = soa.split()
+        if parts:
+            domains.append(parts[0].rstrip("."))
+    return domains
+
+
+def _parse_srv(values):
+    """SRV -> des services genre _sip ou _xmpp avec leur serveur (4e champ)"""
+    domains = []
+    for srv in values:
+        parts = srv.split()
+        if len(parts) >= 4:
+            domains.append(parts[3])
+    return domains
+
+
+def _parse_txt(values):
+    """TXT -> ya souvent des trucs SPF dedans avec des includes
+    on lance la regex (include: et redirect= en un passage) que sur les SPF,
+    les autres TXT (DKIM, vérifications...) sont ignorés direct
+    les noms sont mis en minuscules comme ceux des autres enregistrements"""
+    return [target.rstrip(".").lower() for txt in values if "v=spf1" in txt
+            for target in _SPF_TARGET_RE.findall(txt)]
+
+
+def _parse_caa(values):
+    """CAA -> les autorités de certification autorisées"""
+    domains = []
+    for caa in values:
+        parts = caa.split()
+        if len(parts) >= 3:
+            domain_part = parts[-1].strip('"').rstrip(".")
+            if "." in domain_part and not domain_part.startswith("http"):
+                domains.append(domain_part)
+    return domains
+
+
+"""pour chaque type d'enregistrement, la fonction qui en sort les domaines
+pour gérer un nouveau type il suffit de rajouter une entrée ici"""
+_PARSERS = {
+    "CNAME": _parse_names,
+    "MX": _parse_mx,
+    "NS": _parse_names,
+    "SOA": _parse_soa,
+    "SRV": _parse_srv,
+    "TXT": _parse_txt,
+    "CAA": _parse_caa,
+    "PTR": _parse_names,
+}
+
+
+def _extract_targets(records, reverse_ptrs):
+    """Sort tout les domaines cités dans les enregistrements (sans le parent)"""
     domains = set()
     
-    """A -> on fait un reverse DNS pour trouver les domaines associés aux IPs"""
-    if "A" in records:
-        for ip in records["A"]:
-            ptr_domains = reverse_dns(ip)
-            for ptr_domain in ptr_domains:
-                if ptr_domain and "." in ptr_domain:
-                    domains.add(ptr_domain)
-    
-    """AAAA -> pareil mais pour les IPv6"""
-    if "AAAA" in records:
-        for ip in records["AAAA"]:
-            ptr_domains = reverse_dns(ip)
-            for ptr_domain in ptr_domains:
-                if ptr_domain and "." in ptr_domain:
-                    domains.add(ptr_domain)
-    
-    """CNAME -> c'est une redirection vers un autre domaine"""
-    if "CNAME" in records:
-        for cname in records["CNAME"]:
-            domains.add(cname.rstrip("."))
-    
-    """MX -> c'est les serveurs mails, genre smtp.google.com"""
-    if "MX" in records:
-        for mx in records["MX"]:
-            parts = mx.split()
-            if len(parts) >= 2:
-                domains.add(parts[1].rstrip("."))
-    
-    """NS -> les serveurs DNS qui gèrent le domaine"""
-    if "NS" in records:
-        for ns in records["NS"]:
-            domains.add(ns.rstrip("."))
-    
-    """SOA -> le serveur DNS primaire du domaine"""
-    if "SOA" in records:
-        for soa in records["SOA"]:
-            parts = soa.split()
-            if parts:
-                domains.add(parts[0].rstrip("."))
-    
-    """SRV -> des services genre _sip ou _xmpp avec leur serveur"""
-    if "SRV" in records:
-        for srv in records["SRV"]:
-            parts = srv.split()
-            if len(parts) >= 4:
-                domains.add(parts[3].rstrip("."))
-    
-    """TXT -> ya souvent des trucs SPF dedans avec des includes"""
-    if "TXT" in records:
-        for txt in records["TXT"]:
-            if "include:" in txt:
-
-                includes = re.findall(r'include:([^\s"]+)', txt)
-                for inc in includes:
-                    domains.add(inc.rstrip("."))
-            if "redirect=" in txt:
-
-                redirects = re.findall(r'redirect=([^\s"]+)', txt)
-                for redir in redirects:
-                    domains.add(redir.rstrip("."))
+    for rtype, values in records.items():
+        """A / AAAA -> on prend les domaines du reverse DNS des IPs"""
+        if rtype in ("A", "AAAA"):
+            for ip in values:
+                ptr_domains = reverse_ptrs.get(ip, []) if reverse_ptrs is not None else reverse_dns(ip)
+                for ptr_domain in ptr_domains:
+                    if ptr_domain and "." in ptr_domain:
+                        domains.add(ptr_domain)
+            continue
+        
+        """les autres types passent par leur parser"""
+        parser = _PARSERS.get(rtype)
+        if parser:
+            domains.update(parser(values))
     
-    """CAA -> les autorités de certification autorisées"""
-    if "CAA" in records:
-        for caa in records["CAA"]:
-            parts = caa.split()
-            if len(parts) >= 3:
-                domain_part = parts[-1].strip('"').rstrip(".")
-                if "." in domain_part and not domain_part.startswith("http"):
-                    domains.add(domain_part)
-    
-    """PTR -> résolution inverse, genre IP vers nom de domaine"""
-    if "PTR" in records:
-        for ptr in records["PTR"]:
-            domains.add(ptr.rstrip("."))
+    return domains
+
+
+def extract_domains_from_records(records, current_domain, reverse_ptrs=None):
+    """Cette fonction extrait tout les domaines qu'on trouve dans les enregistrements
+    comme sa on peut les explorer après dans les prochaines couches
+    reverse_ptrs c'est les PTR déja résolus par IP ({ip: [noms]}), si on le donne
+    pas on fait le reverse DNS ici
+    les mêmes enregistrements donnent toujours les mêmes domaines donc on garde
+    le résultat en cache (seulement quand les PTR sont donnés, sinon sa dépend du réseau)"""
+    if reverse_ptrs is None:
+        domains = _extract_targets(records, None)
+    else:
+        key = (tuple(sorted((rtype, tuple(values)) for rtype, values in records.items())),
+               tuple(sorted((ip, tuple(names)) for ip, names in reverse_ptrs.items())))
+        cached = _EXTRACT_CACHE.get(key)
+        if cached is None:
+            cached = frozenset(_extract_targets(records, reverse_ptrs))
+            if len(_EXTRACT_CACHE) >= CACHE_MAX_SIZE:
+                _EXTRACT_CACHE.pop(next(iter(_EXTRACT_CACHE)))
+            _EXTRACT_CACHE[key] = cached
+        domains = set(cached)
     
     """on ajoute aussi le domaine parent pour remonter la hiérarchie"""
     parent = get_parent_domain(current_domain)
@@ -144,60 +390,80 @@ def extract_domains_from_records(records, current_domain):
     return domains
 
 
-def resolve_layer(domains, layer_num, all_resolved, graph_edges, domain_layers):
-    """Cette fonction résoud une couche complète de domaines
-    elle affiche les résultats et retourne les nouveaux domaines a explorer"""
+async def resolve_layer_async(domains, layer_num, all_resolved, graph_edges, domain_layers,
+                              per_query=3, per_domain_deadline=None):
+    """Cette fonction résoud une couche complète de domaines en parallèle
+    elle affiche les résultats et retourne les nouveaux domaines a explorer
+    per_query c'est le timeout d'une requete, per_domain_deadline le max par domaine"""
     print(f"\n{'='*60}")
     print(f" Couche n° {layer_num}")
     print(f"{'='*60}")
     
     next_domains = set()
     
-    """on boucle sur chaque domaine de la couche"""
-    for domain in sorted(domains):
-        print(f"\n • {domain}")
-        
-        """on enregistre la couche du domaine pour le graphe"""
-        domain_layers[domain] = layer_num
+    """on limite le nombre de requetes en vol pour pas saturer le resolver
+    le sémaphore est partagé par toutes les requetes de la couche (tout types et domaines
+    confondus) donc un domaine lent bloque qu'une place par requete et pas tout un domaine"""
+    sem = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+    
+    async def resolve_one(domain):
+        """résoud un domaine et prépare son affichage, on print rien ici
+        sinon les domaines s'afficheraient mélangés"""
+        records, spent = await _resolve_domain(domain, per_query, per_domain_deadline, sem)
         
-        """on résoud tout les enregistrements du domaine"""
-        records = resolve_all_records(domain)
+        """on fait tout les reverse DNS des IPs en même temps, avec ce qui reste
+        de la deadline du domaine (sinon un PTR qui traîne la fait dépasser)"""
+        ips = records.get("A", ()) + records.get("AAAA", ())
+        remaining = None if per_domain_deadline is None else max(per_domain_deadline - spent, 0)
+        reverse_ptrs = await _reverse_ips(ips, per_query, remaining, sem)
         
+        lines = [f"\n • {domain}"]
         if not records:
-            print(f" └─ Il n'y a aucun enregistement trouvé")
+            lines.append(f" └─ Il n'y a aucun enregistement trouvé")
         else:
             """on affiche les 3 premiers de chaque type"""
             for rtype, values in records.items():
                 for val in values[:3]:
-                    print(f" ├─ {rtype}: {val}")
-                    """si c'est une IP, on fait le reverse DNS et on l'affiche"""
+                    lines.append(f" ├─ {rtype}: {val}")
+                    """si c'est une IP, on affiche son reverse DNS"""
                     if rtype in ("A", "AAAA"):
-                        ptr_results = reverse_dns(val)
-                        for ptr in ptr_results:
-                            print(f" │   └─ PTR: {ptr}")
+                        for ptr in reverse_ptrs[val]:
+                            lines.append(f" │   └─ PTR: {ptr}")
+        
+        return domain, (records, reverse_ptrs, lines)
+    
+    """on lance tout les domaines de la couche en même temps, l'ordre importe pas ici"""
+    results = dict(await asyncio.gather(*[resolve_one(domain) for domain in domains]))
+    
+    """on trie seulement maintenant pour afficher et traiter dans un ordre stable"""
+    for domain in sorted(results):
+        records, reverse_ptrs, lines = results[domain]
+        print("\n".join(lines))
+        
+        """on enregistre la couche du domaine pour le graphe"""
+        domain_layers[domain] = layer_num
         
-        """on check si le parent est pas déja exploré"""
-        parent = get_parent_domain(domain)
-        if parent and parent not in all_resolved and parent not in domains:
-            next_domains.add(parent)
-            graph_edges.append((domain, parent))
-
-        """on extrait tout les domaines des enregistrements"""
-        found = extract_domains_from_records(records, domain)
-        new_domains = found - all_resolved - domains
+        """on extrait tout les domaines des enregistrements (le parent est déja dedans)"""
+        found = extract_domains_from_records(records, domain, reverse_ptrs)
+        
+        """on retire en place ce qui est déja exploré, sans créer de sets intermédiaires"""
+        found.difference_update(all_resolved)
+        found.difference_update(domains)
+        new_domains = found
         
         """on ajoute les liens pour le graphe"""
         for target in new_domains:
             graph_edges.append((domain, target))
         
-        if new_domains:
-            next_domains.update(new_domains)
+        next_domains |= new_domains
     
     print(f"\n   → {len(next_domains)} nouveau(x) domaine(s) à explorer")
     return next_domains
 
 
-def explore_dns(domain, max_layers, export=False, output_dir="exports"):
+def explore_dns(domain, max_layers, export=False, output_dir="exports",
+                per_query=3, per_domain_deadline=10, nameservers=None,
+                formats=DEFAULT_EXPORT_FORMATS, show_labels=None, show=True):
     """Explore un domaine DNS sur plusieurs couches
     
     Args:
@@ -205,6 +471,12 @@ def explore_dns(domain, max_layers, export=False, output_dir="exports"):
         max_layers: Nombre de couches à explorer
         export: Si True, exporte le graphe
         output_dir: Dossier pour les exports
+        per_query: Timeout d'une requete DNS en secondes
+        per_domain_deadline: Temps max en secondes pour résoudre un domaine (None = pas de limite)
+        nameservers: Serveurs DNS a interroger (None = ceux du système)
+        formats: Formats d'export ('svg', 'png', 'dot')
+        show_labels: True = tous les labels, False = aucun, None = automatique selon la taille
+        show: False pour pas ouvrir la fenêtre du graphe (juste les exports)
         
     Returns:
         tuple: (all_resolved, graph_edges, domain_layers)
@@ -215,6 +487,9 @@ def explore_dns(domain, max_layers, export=False, output_dir="exports"):
     print(f" Domaine: {domain}")
     print(f" Couches: {max_layers}")
     
+    """serveurs DNS du resolver partagé pour cette exploration (ceux du système si None)"""
+    set_nameservers(nameservers)
+    
     """on commence avec le domaine donné"""
     current_domains = {domain}
     all_resolved = set()
@@ -225,7 +500,8 @@ def explore_dns(domain, max_layers, export=False, output_dir="exports"):
     
     """on boucle sur chaque couche"""
     for layer in range(1, max_layers + 1):
-        to_resolve = current_domains - all_resolved
+        current_domains.difference_update(all_resolved)
+        to_resolve = current_domains
         
         """si il y a plus rien a explorer on arrête"""
         if not to_resolve:
@@ -233,7 +509,10 @@ def explore_dns(domain, max_layers, export=False, output_dir="exports"):
             break
         
         all_resolved.update(to_resolve)
-        next_domains = resolve_layer(to_resolve, layer, all_resolved, graph_edges, domain_layers)
+        next_domains = asyncio.run(
+            resolve_layer_async(to_resolve, layer, all_resolved, graph_edges, domain_layers,
+                                per_query, per_domain_deadline)
+        )
         current_domains = next_domains
     
     """a la fin on affiche le résumé de tout ce qu'on a trouvé"""
@@ -250,13 +529,45 @@ def explore_dns(domain, max_layers, export=False, output_dir="exports"):
             if target not in domain_layers:
                 domain_layers[target] = max_layer + 1
     
-    """on affiche le graphe à la fin"""
+    """on affiche le graphe à la fin, dans un processus à part pour rendre la main tout de suite
+    pendant que la fenêtre est ouverte ; si y'a que les exports à faire on les fait ici,
+    comme ça ils existent quand on rend la main (et une boucle de batch lance pas
+    un processus de rendu par exploration)"""
     if len(domain_layers) > 0:
-        draw_dns_graph(graph_edges, domain_layers, domain, output_dir if export else None)
+        graph_dir = output_dir if export else None
+        if window_will_open(graph_dir, show):
+            draw_dns_graph_in_background(graph_edges, domain_layers, domain, graph_dir,
+                                         formats, show_labels, show=show)
+        else:
+            draw_dns_graph(graph_edges, domain_layers, domain, graph_dir,
+                           formats, show_labels, show=show)
     
     return all_resolved, graph_edges, domain_layers
 
 
+def parse_formats(value):
+    """Transforme "png,svg" en ('png', 'svg') et refuse les formats inconnus"""
+    formats = tuple(f.strip().lower() for f in value.split(",") if f.strip())
+    unknown = [f for f in formats if f not in EXPORT_FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(
+            f"format(s) invalide(s): {value} (possibles: {','.join(EXPORT_FORMATS)})")
+    return formats
+
+
+def parse_nameserver(value):
+    """Vérifie qu'un serveur DNS donné en ligne de commande est une IP (v4 ou v6)
+    un nom comme "dns.google" marche pas, il faudrait déja le résoudre
+    et une URL https (DNS over HTTPS) demande httpx qu'on installe pas, donc on la refuse
+    plutot que de voir toutes les requetes échouer sans rien dire"""
+    value = value.strip()
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"serveur DNS invalide: {value} (une IP comme 1.1.1.1 ou 2606:4700:4700::1111)")
+
+
 def parse_args():
     """Parse les arguments de la ligne de commande"""
 
@@ -268,6 +579,7 @@ def parse_args():
 Exemples:
   python dns_explorer.py -d google.com -l 3
   python dns_explorer.py --domain example.org --layers 5 --export
+  python dns_explorer.py -d example.org --export --formats svg,png,dot
   python dns_explorer.py --loop  (mode interactif)
         """
     )
@@ -285,10 +597,50 @@ Exemples:
         help="Nombre de couches à explorer (défaut: 3)"
     )
     
+    parser.add_argument(
+        "-t", "--timeout",
+        type=float,
+        default=3,
+        help="Timeout d'une requete DNS en secondes (défaut: 3)"
+    )
+    
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=10,
+        help="Temps max pour résoudre un domaine en secondes (défaut: 10)"
+    )
+    
+    parser.add_argument(
+        "-n", "--nameserver",
+        action="append",
+        type=parse_nameserver,
+        help="Serveur DNS a interroger, répétable (défaut: ceux du système)"
+    )
+    
     parser.add_argument(
         "-e", "--export",
         action="store_true",
-        help="Exporter le graphe en DOT/SVG/PNG"
+        help="Exporter le graphe (formats choisis avec --formats)"
+    )
+    
+    parser.add_argument(
+        "-f", "--formats",
+        type=parse_formats,
+        default=DEFAULT_EXPORT_FORMATS,
+        help="Formats d'export séparés par des virgules parmi svg,png,dot (défaut: png,dot)"
+    )
+    
+    parser.add_argument(
+        "--all-labels",
+        action="store_true",
+        help="Afficher le nom de tous les domaines, même sur les gros graphes"
+    )
+    
+    parser.add_argument(
+        "--no-show",
+        action="store_true",
+        help="Ne pas ouvrir la fenêtre du graphe (juste les exports)"
     )
     
     parser.add_argument(
@@ -307,8 +659,24 @@ Exemples:
     return parser.parse_args()
 
 
-def interactive_mode():
-    """Mode interactif qui boucle en continu"""
+def explore_options(args):
+    """Les options d'explore_dns prises dans la ligne de commande, les mêmes pour
+    le mode ligne de commande et le mode interactif"""
+    return dict(output_dir=args.output, per_query=args.timeout,
+                per_domain_deadline=args.deadline, nameservers=args.nameserver,
+                formats=args.formats, show_labels=True if args.all_labels else None,
+                show=not args.no_show)
+
+
+def interactive_mode(args=None):
+    """Mode interactif qui boucle en continu
+    args c'est la ligne de commande (parse_args), ses options valent pour chaque exploration
+    -l sert de nombre de couches par défaut et avec -e on demande plus si il faut exporter"""
+    options = explore_options(args) if args is not None else {}
+    formats = options.get("formats", DEFAULT_EXPORT_FORMATS)
+    default_layers = args.layers if args is not None else 3
+    always_export = args is not None and args.export
+    
     while True:
         print("\n" + "=" * 60)
         print(" Mode interactif - Exploration DNS")
@@ -324,13 +692,16 @@ def interactive_mode():
         try:
             max_layers = int(input(" Nombre de couches: ").strip())
         except:
-            max_layers = 3
+            max_layers = default_layers
         
         """on demande si l'utilisateur veut exporter le graphe"""
-        export = input(" Exporter le graphe (DOT/SVG/PNG)? (o/n): ").strip().lower()
-        do_export = export in ('o', 'oui', 'y', 'yes')
+        if always_export:
+            do_export = True
+        else:
+            export = input(f" Exporter le graphe ({'/'.join(formats).upper()})? (o/n): ")
+            do_export = export.strip().lower() in ('o', 'oui', 'y', 'yes')
         
-        explore_dns(domain, max_layers, export=do_export)
+        explore_dns(domain, max_layers, export=do_export, **options)
         
         print("\n" + "-" * 60)
         print(" Redémarrage automatique...")
@@ -343,10 +714,10 @@ def main():
     
     if args.loop or args.domain is None:
         """Mode interactif"""
-        interactive_mode()
+        interactive_mode(args)
     else:
         """Mode ligne de commande"""
-        explore_dns(args.domain, args.layers, export=args.export, output_dir=args.output)
+        explore_dns(args.domain, args.layers, export=args.export, **explore_options(args))
 
 
 if __name__ == "__main__":
@@ -1,85 +1,175 @@
 """dns_graph.py - Configuration et affichage du graphe DNS"""
 
+import io
+import os
+import sys
+import multiprocessing as mp
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import networkx as nx
+import matplotlib
+
+"""Pas d'écran (serveur, CI, ssh...) -> backend Agg sans fenêtre, a choisir avant d'importer pyplot
+sous Windows et macOS ya toujours un affichage donc on touche a rien"""
+HEADLESS = (sys.platform.startswith("linux")
+            and not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"))
+if HEADLESS:
+    matplotlib.use("Agg")
+
 import matplotlib.pyplot as plt
-import os
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from matplotlib.transforms import Bbox
+
+"""Mapping couleur par couche"""
+LAYER_COLORS = {
+    1: '#6624a8',  # violet - départ
+    2: '#e67e30',  # orange
+    3: '#e60029',  # rouge
+    4: '#96CEB4',  # vert
+    5: '#4FC3F7',  # bleu clair
+    6: '#FFD54F',  # jaune
+}
+DEFAULT_COLOR = '#DDA0DD'
+
+"""Les mêmes couleurs en table indexée par le numéro de couche, pour le dessin
+la dernière case (DEFAULT_COLOR) sert a toutes les couches au dela"""
+_LAYER_COLOR_LIST = np.array([LAYER_COLORS.get(layer, DEFAULT_COLOR)
+                              for layer in range(max(LAYER_COLORS) + 2)])
+
+"""Formats d'export possibles et ceux faits par défaut
+le SVG est opt-in : sur les gros graphes matplotlib met bien plus de temps
+a écrire un SVG qu'un PNG (environ 4x) pour un fichier qui sert rarement"""
+EXPORT_FORMATS = ('svg', 'png', 'dot')
+DEFAULT_EXPORT_FORMATS = ('png', 'dot')
+
+"""A partir de combien de noeuds, ou d'arêtes, on dessine les arêtes en un seul bloc
+de segments droits (LineCollection) plutot qu'une flèche courbée par arête"""
+LINE_COLLECTION_MIN_NODES = 50
+CURVED_EDGES_MAX_EDGES = 200
+
+"""Au dela de combien de noeuds on affiche plus tous les labels (voir build_dns_figure)"""
+LABELS_MAX_NODES = 100
 
+"""Résolution des exports PNG/SVG"""
+EXPORT_DPI = 150
 
-def hierarchical_layout(G):
-    """Crée un layout hiérarchique où les enfants sont proche de leur parent"""
-    pos = {}
+
+def hierarchical_layout(G, node_layer=None, node_names=None):
+    """Crée un layout hiérarchique où les enfants sont proche de leur parent
+    node_layer c'est la couche de chaque noeud ({noeud: couche}), si on le donne
+    pas on le relit dans les attributs 'layer' du graphe
+    node_names c'est le nom de chaque noeud quand les noeuds sont des numéros
+    (liste indexée par le numéro), la première couche est triée par nom
+    en interne les positions sont deux tableaux numpy (pos_x, pos_y) indexés par le
+    numéro du noeud, le dict {noeud: (x, y)} est construit seulement à la fin"""
+    if node_layer is None:
+        node_layer = dict(G.nodes(data='layer', default=1))
     
     """On groupe les noeuds par couche"""
     layers = {}
     for node in G.nodes():
-        layer = G.nodes[node].get('layer', 1)
-        if layer not in layers:
-            layers[layer] = []
-        layers[layer].append(node)
+        layers.setdefault(node_layer[node], []).append(node)
     
     sorted_layers = sorted(layers.keys())
     if not sorted_layers:
-        return pos
+        return {}
     
     x_spacing = 4.0
     y_spacing = 1.5
     
+    """Chaque noeud a un indice, et les arêtes deviennent deux tableaux d'indices
+    (source, cible) pour calculer les moyennes des parents avec numpy"""
+    node_idx = {node: i for i, node in enumerate(G.nodes())}
+    num_nodes = len(node_idx)
+    layer_arr = np.array([node_layer[node] for node in G.nodes()])
+    edge_idx = np.array([(node_idx[u], node_idx[v]) for u, v in G.edges()], dtype=np.intp)
+    edge_idx = edge_idx.reshape(-1, 2)
+    src, tgt = edge_idx[:, 0], edge_idx[:, 1]
+    pos_x = layer_arr * x_spacing
+    pos_y = np.zeros(num_nodes)
+    placed = np.zeros(num_nodes, dtype=bool)
+    
     """Première couche : on place les noeuds verticalement"""
     first_layer = sorted_layers[0]
-    nodes = sorted(layers[first_layer])
+    nodes = sorted(layers[first_layer],
+                   key=node_names.__getitem__ if node_names is not None else None)
     total_height = (len(nodes) - 1) * y_spacing
     start_y = total_height / 2
-    for i, node in enumerate(nodes):
-        pos[node] = (first_layer * x_spacing, start_y - i * y_spacing)
+    
+    """Les Y de toute la couche d'un coup avec numpy"""
+    ys = start_y - np.arange(len(nodes), dtype=np.float64) * y_spacing
+    idx = np.fromiter((node_idx[node] for node in nodes), dtype=np.intp, count=len(nodes))
+    pos_y[idx] = ys
+    placed[idx] = True
     
     """Couches suivantes : on place les enfants près de leur parent"""
     for layer_num in sorted_layers[1:]:
         nodes = layers[layer_num]
-        node_y_targets = {}
         
-        """Pour chaque noeud (on calcule la position Y moyenne de ses parents)"""
-        for node in nodes:
-            parent_ys = []
-            for pred in G.predecessors(node):
-                if pred in pos:
-                    parent_ys.append(pos[pred][1])
-            
-            if parent_ys:
-                node_y_targets[node] = sum(parent_ys) / len(parent_ys)
-            else:
-                node_y_targets[node] = 0
+        """Position Y moyenne des parents déja placés, en un seul passage sur les arêtes
+        (np.add.at cumule les Y des sources sur chaque cible)"""
+        mask = (layer_arr[tgt] == layer_num) & placed[src]
+        sum_y = np.zeros(num_nodes)
+        count = np.zeros(num_nodes, dtype=np.int64)
+        np.add.at(sum_y, tgt[mask], pos_y[src[mask]])
+        np.add.at(count, tgt[mask], 1)
+        
+        """Pas de parent placé -> cible à 0"""
+        idx = np.fromiter((node_idx[node] for node in nodes), dtype=np.intp, count=len(nodes))
+        targets = np.where(count[idx] > 0, sum_y[idx] / np.maximum(count[idx], 1), 0.0)
         
-        """On trie les noeuds par leur position Y cible"""
-        sorted_nodes = sorted(nodes, key=lambda n: node_y_targets[n], reverse=True)
+        """On trie les noeuds par leur position Y cible (tri stable comme avant)"""
+        target_list = targets.tolist()
+        order = sorted(range(len(nodes)), key=lambda i: target_list[i], reverse=True)
+        sorted_idx = idx[order]
         
         """On place les noeuds avec un espacement minimum"""
-        x = layer_num * x_spacing
-        if len(sorted_nodes) == 1:
-            pos[sorted_nodes[0]] = (x, node_y_targets[sorted_nodes[0]])
+        if len(sorted_idx) == 1:
+            ys = targets[order]
         else:
             """On évite les chevauchements en espaçant les noeuds"""
-            total_height = (len(sorted_nodes) - 1) * y_spacing
-            center_y = sum(node_y_targets.values()) / len(node_y_targets)
+            total_height = (len(sorted_idx) - 1) * y_spacing
+            center_y = targets.sum() / len(targets)
             start_y = center_y + total_height / 2
-            
-            for i, node in enumerate(sorted_nodes):
-                pos[node] = (x, start_y - i * y_spacing)
+            ys = start_y - np.arange(len(sorted_idx), dtype=np.float64) * y_spacing
+        
+        pos_y[sorted_idx] = ys
+        placed[sorted_idx] = True
     
-    return pos
+    return dict(zip(node_idx, zip(pos_x.tolist(), pos_y.tolist())))
 
 
-def draw_dns_graph(edges, all_domains, start_domain, output_dir=None):
-    """Dessine le graphe DNS avec les données de l'exploration"""
+def build_dns_figure(edges, all_domains, start_domain, show_labels=None):
+    """Construit le graphe networkx et dessine la figure matplotlib sans l'afficher
+    show_labels : True = tous les labels, False = aucun, None = automatique
+    (au dela de LABELS_MAX_NODES noeuds seulement le domaine de départ et la couche 1)
+    dans G les noeuds sont des numéros (hasher un entier coute moins qu'un long nom
+    de domaine), les noms sont dans G.graph['names'], indexés par le numéro
+    Retourne (G, fig)"""
+    
+    """Un numéro par domaine, dans l'ordre des couches puis des arêtes (les domaines
+    qui apparaissent que dans les arêtes sont ajoutés à la suite)"""
+    idx2name = list(all_domains)
+    name2idx = {name: i for i, name in enumerate(idx2name)}
+    edge_idx = []
+    for source, target in edges:
+        for name in (source, target):
+            if name not in name2idx:
+                name2idx[name] = len(idx2name)
+                idx2name.append(name)
+        edge_idx.append((name2idx[source], name2idx[target]))
     
-    G = nx.DiGraph()
+    G = nx.DiGraph(names=idx2name)
     
-    """On ajoute les noeuds avec leur couche"""
-    for domain, layer in all_domains.items():
-        G.add_node(domain, layer=layer)
+    """On ajoute les noeuds avec leur couche, puis les arêtes, en un seul appel chacun"""
+    G.add_nodes_from((i, {'layer': layer}) for i, layer in enumerate(all_domains.values()))
+    G.add_edges_from(edge_idx)
     
-    """On ajoute les arêtes"""
-    for source, target in edges:
-        G.add_edge(source, target)
+    """La couche de chaque noeud, lue une seule fois pour tout le dessin"""
+    node_layer = dict(G.nodes(data='layer', default=1))
     
     """Taille dynamique selon le nombre de noeuds"""
     num_nodes = G.number_of_nodes()
@@ -109,115 +199,294 @@ def draw_dns_graph(edges, all_domains, start_domain, output_dir=None):
               fontsize=18, fontweight='bold', color='white', pad=20)
     
     """Layout hiérarchique par couche"""
-    pos = hierarchical_layout(G)
-    
-    """Mapping couleur par couche"""
-    layer_colors = {
-        1: '#6624a8',  # violet - départ
-        2: '#e67e30',  # orange
-        3: '#e60029',  # rouge
-        4: '#96CEB4',  # vert
-        5: '#4FC3F7',  # bleu clair
-        6: '#FFD54F',  # jaune
-    }
-    default_color = '#DDA0DD'
-    
-    """Couleurs selon la couche"""
-    colors = []
-    for node in G.nodes():
-        layer = G.nodes[node].get('layer', 1)
-        colors.append(layer_colors.get(layer, default_color))
+    pos = hierarchical_layout(G, node_layer, idx2name)
+    
+    """Couleurs selon la couche, lues dans _LAYER_COLOR_LIST par numéro de couche"""
+    last_color = len(_LAYER_COLOR_LIST) - 1
+    layer_idx = np.fromiter(node_layer.values(), dtype=np.intp, count=num_nodes)
+    colors = _LAYER_COLOR_LIST[np.minimum(layer_idx, last_color)].tolist()
     
-    """On dessine les noeuds"""
-    nx.draw_networkx_nodes(G, pos, node_color=colors, node_size=node_size, 
-                           alpha=0.9, edgecolors='white', linewidths=1)
+    """On dessine les noeuds, directement avec un scatter sur les positions en numpy
+    (c'est ce que fait draw_networkx_nodes, sans tout ce qu'il y a autour)"""
+    node_xy = np.array([pos[node] for node in G.nodes()], dtype=np.float64).reshape(-1, 2)
+    ax.scatter(node_xy[:, 0], node_xy[:, 1], c=colors, s=node_size, 
+               alpha=0.9, edgecolors='white', linewidths=1, zorder=2)
     
     """On dessine les arêtes"""
-    edge_colors = []
-    for source, target in G.edges():
-        source_layer = G.nodes[source].get('layer', 1)
-        edge_colors.append(layer_colors.get(source_layer, default_color))
+    """couleur de la couche de la source, prise dans la même table"""
+    source_layers = np.fromiter((node_layer[source] for source, _ in G.edges()),
+                                dtype=np.intp, count=G.number_of_edges())
+    edge_colors = _LAYER_COLOR_LIST[np.minimum(source_layers, last_color)].tolist()
     
-    nx.draw_networkx_edges(G, pos, edge_color=edge_colors, arrows=True, 
-                           arrowsize=15, alpha=0.6, width=1.5,
-                           connectionstyle="arc3,rad=0.05")
+    """Les flèches courbées c'est une courbe de Bézier a découper par arête, ça coute
+    cher, on les garde que pour les petits graphes"""
+    use_curves = (num_nodes < LINE_COLLECTION_MIN_NODES
+                  and G.number_of_edges() < CURVED_EDGES_MAX_EDGES)
+    if use_curves:
+        nx.draw_networkx_edges(G, pos, edge_color=edge_colors, arrows=True, 
+                               arrowsize=15, alpha=0.6, width=1.5,
+                               connectionstyle="arc3,rad=0.05")
+    else:
+        """Gros graphe : tous les segments d'un coup dans une LineCollection au lieu
+        d'une flèche (FancyArrowPatch) par arête, sans pointe de flèche,
+        le sens se lit déja de gauche à droite avec les couches"""
+        segments = np.array([(pos[source], pos[target]) for source, target in G.edges()],
+                            dtype=np.float64).reshape(-1, 2, 2)
+        ax.add_collection(LineCollection(segments, colors=edge_colors, linewidths=1.5,
+                                         alpha=0.6, zorder=1))
     
-    """Labels complets à côté des noeuds"""
-    label_pos = {node: (x + 0.3, y) for node, (x, y) in pos.items()}
-    labels = {node: node for node in G.nodes()}
+    """Labels complets à côté des noeuds
+    le placement du texte c'est ce qui coute le plus cher a dessiner (et ça gonfle
+    le SVG), sur un gros graphe on garde seulement le départ et la première couche"""
+    if show_labels is None and num_nodes >= LABELS_MAX_NODES:
+        label_idx = [i for i in G.nodes()
+                     if idx2name[i] == start_domain or node_layer[i] == 1]
+    elif show_labels is False:
+        label_idx = []
+    else:
+        label_idx = list(range(num_nodes))
     
-    nx.draw_networkx_labels(G, label_pos, labels, font_size=font_size, 
-                            font_weight='bold', font_color='white',
-                            horizontalalignment='left')
+    """Un ax.text par label, décalé a droite du noeud, directement depuis les positions
+    numpy (pas de dict de positions décalées à construire comme avant)
+    c'est seulement ici qu'on repasse des numéros aux noms de domaine"""
+    label_x = (node_xy[label_idx, 0] + 0.3).tolist()
+    label_y = node_xy[label_idx, 1].tolist()
+    for i, x, y in zip(label_idx, label_x, label_y):
+        ax.text(x, y, idx2name[i], size=font_size, weight='bold', color='white',
+                family='sans-serif', horizontalalignment='left',
+                verticalalignment='center', clip_on=True)
     
-    """Légende des couleurs"""
+    """Légende des couleurs, seulement pour les couches présentes dans le graphe
+    (un simple Line2D vide par couche suffit comme marqueur de légende)"""
+    present_layers = set(node_layer.values())
     legend_elements = [
-        plt.scatter([], [], c='#6624a8', s=150, label='Couche 1'),
-        plt.scatter([], [], c='#e67e30', s=150, label='Couche 2'),
-        plt.scatter([], [], c='#e60029', s=150, label='Couche 3'),
-        plt.scatter([], [], c='#96CEB4', s=150, label='Couche 4'),
-        plt.scatter([], [], c='#4FC3F7', s=150, label='Couche 5'),
-        plt.scatter([], [], c='#FFD54F', s=150, label='Couche 6'),
-        plt.scatter([], [], c='#DDA0DD', s=150, label='Couche 7+'),
+        Line2D([], [], marker='o', linestyle='', markersize=12, markerfacecolor=color,
+               markeredgecolor='white', label=f'Couche {layer}')
+        for layer, color in LAYER_COLORS.items() if layer in present_layers
     ]
-    plt.legend(handles=legend_elements, loc='upper left', 
-               facecolor='#2d2d44', edgecolor='white', labelcolor='white',
-               fontsize=10)
+    if any(layer not in LAYER_COLORS for layer in present_layers):
+        legend_elements.append(
+            Line2D([], [], marker='o', linestyle='', markersize=12, markerfacecolor=DEFAULT_COLOR,
+                   markeredgecolor='white', label=f'Couche {max(LAYER_COLORS) + 1}+'))
+    
+    if legend_elements:
+        plt.legend(handles=legend_elements, loc='upper left', 
+                   facecolor='#2d2d44', edgecolor='white', labelcolor='white',
+                   fontsize=10)
     
     plt.axis('off')
-    plt.tight_layout()
     
-    """Export si demandé"""
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        safe_name = start_domain.replace('.', '_').replace(':', '_')
+    """Marges fixes plutot que tight_layout, qui repasse sur tous les artistes pour
+    les calculer (et que savefig refaisait a chaque sauvegarde), il faut juste
+    garder de la place en haut pour le titre"""
+    fig.subplots_adjust(left=0, right=1, bottom=0, top=0.95)
+    
+    return G, fig
+
+
+def render_figure_exports(fig, formats=DEFAULT_EXPORT_FORMATS):
+    """Rend la figure en mémoire dans les formats d'image demandés ('png', 'svg')
+    retourne {format: octets}, pour qui veut les images sans passer par le disque"""
+    exports = {}
+    if 'svg' not in formats and 'png' not in formats:
+        return exports
+    
+    """Un seul vrai rendu Agg à la résolution d'export : il sert à calculer la zone
+    utile de la figure (l'équivalent de bbox_inches='tight') et le PNG est découpé
+    directement dans ses pixels au lieu de refaire tout le rendu avec savefig
+    on remet le canvas et la résolution d'origine après, pour la fenêtre"""
+    old_canvas, old_dpi = fig.canvas, fig.dpi
+    canvas = FigureCanvasAgg(fig)
+    try:
+        fig.dpi = EXPORT_DPI
+        canvas.draw()
+        """Les axes prennent toute la largeur de la figure (marges fixes), la marge
+        de 0.1 pouce autour de la zone utile est donc coupée aux bords de la figure"""
+        bbox = Bbox.intersection(fig.get_tightbbox(canvas.get_renderer()).padded(0.1),
+                                 fig.bbox_inches)
+        
+        if 'png' in formats:
+            exports['png'] = _png_from_canvas(canvas, bbox)
+            if exports['png'] is None:
+                exports['png'] = _savefig_bytes(fig, 'png', bbox)
         
-        svg_path = os.path.join(output_dir, f"{safe_name}_graph.svg")
-        plt.savefig(svg_path, format='svg', facecolor='#1a1a2e', 
-                    edgecolor='none', bbox_inches='tight', dpi=150)
-        print(f"  SVG sauvegardé: {svg_path}")
+        """Le SVG c'est un autre backend, lui il repasse forcément sur les artistes"""
+        if 'svg' in formats:
+            exports['svg'] = _savefig_bytes(fig, 'svg', bbox)
+    finally:
+        fig.dpi = old_dpi
+        fig.set_canvas(old_canvas)
+    
+    return exports
+
+
+def save_dns_exports(edges, all_domains, start_domain, output_dir, fig=None,
+                     formats=DEFAULT_EXPORT_FORMATS):
+    """Sauvegarde les exports demandés dans output_dir ('svg', 'png', 'dot')
+    le SVG et le PNG ont besoin de la figure, le DOT non"""
+    os.makedirs(output_dir, exist_ok=True)
+    safe_name = start_domain.replace('.', '_').replace(':', '_')
+    
+    """Le DOT a pas besoin de la figure, il s'écrit dans un thread à part pendant
+    que matplotlib rend les images"""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        dot_future = None
+        if 'dot' in formats:
+            dot_path = os.path.join(output_dir, f"{safe_name}_graph.dot")
+            dot_future = executor.submit(export_to_dot, edges, all_domains, dot_path,
+                                         LAYER_COLORS, DEFAULT_COLOR)
         
-        dot_path = os.path.join(output_dir, f"{safe_name}_graph.dot")
-        export_to_dot(G, dot_path, layer_colors, default_color)
-        print(f"  DOT sauvegardé: {dot_path}")
+        """Les images sont rendues en mémoire puis écrites d'un seul coup chacune"""
+        if fig is not None:
+            for fmt, data in render_figure_exports(fig, formats).items():
+                path = os.path.join(output_dir, f"{safe_name}_graph.{fmt}")
+                Path(path).write_bytes(data)
+                print(f"  {fmt.upper()} sauvegardé: {path}")
         
-        png_path = os.path.join(output_dir, f"{safe_name}_graph.png")
-        plt.savefig(png_path, format='png', facecolor='#1a1a2e', 
-                    edgecolor='none', bbox_inches='tight', dpi=150)
-        print(f"  PNG sauvegardé: {png_path}")
+        if dot_future is not None:
+            dot_future.result()
+            print(f"  DOT sauvegardé: {dot_path}")
+
+
+def _png_from_canvas(canvas, bbox):
+    """Encode en PNG la zone bbox (en pouces) découpée dans le rendu Agg déja fait
+    retourne None si la zone dépasse de la figure, dans ce cas il faut un vrai
+    savefig qui agrandit la toile"""
+    pixels = np.asarray(canvas.buffer_rgba())
+    height, width = pixels.shape[:2]
+    """Même taille d'image que savefig (qui tronque la largeur et la hauteur en pixels)"""
+    x0, y0 = int(bbox.x0 * EXPORT_DPI), int(bbox.y0 * EXPORT_DPI)
+    x1, y1 = x0 + int(bbox.width * EXPORT_DPI), y0 + int(bbox.height * EXPORT_DPI)
+    if bbox.x0 < 0 or bbox.y0 < 0 or x1 > width or y1 > height:
+        return None
+    
+    """Les lignes du buffer partent du haut, les Y de la bbox du bas"""
+    buf = io.BytesIO()
+    plt.imsave(buf, pixels[height - y1:height - y0, x0:x1], format='png', dpi=EXPORT_DPI)
+    return buf.getvalue()
+
+
+def _savefig_bytes(fig, fmt, bbox):
+    """savefig dans un buffer en mémoire, avec le fond et la zone des exports"""
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, facecolor='#1a1a2e', 
+                edgecolor='none', bbox_inches=bbox, dpi=EXPORT_DPI)
+    return buf.getvalue()
+
+
+def _named_graph(G):
+    """Copie de G avec les noms de domaine comme noeuds a la place des numéros
+    de build_dns_figure, pour ceux qui récupèrent le graphe"""
+    return nx.relabel_nodes(G, dict(enumerate(G.graph['names'])))
+
+
+def export_only(edges, all_domains, start_domain, output_dir, formats=DEFAULT_EXPORT_FORMATS,
+                show_labels=None):
+    """Exporte le graphe sans jamais l'afficher (serveur, CI...)
+    si on veut que du DOT on touche même pas a networkx/matplotlib"""
+    if 'svg' not in formats and 'png' not in formats:
+        save_dns_exports(edges, all_domains, start_domain, output_dir, formats=formats)
+        return None
     
-    print(f"\n Ouverture du graphe ({num_nodes} noeuds, {G.number_of_edges()} liens)...")
+    G, fig = build_dns_figure(edges, all_domains, start_domain, show_labels)
+    save_dns_exports(edges, all_domains, start_domain, output_dir, fig, formats)
+    plt.close(fig)
+    return _named_graph(G)
+
+
+def render_interactive(edges, all_domains, start_domain, output_dir=None,
+                       formats=DEFAULT_EXPORT_FORMATS, show_labels=None):
+    """Dessine le graphe, l'exporte si on donne un dossier, puis l'ouvre dans une fenêtre"""
+    G, fig = build_dns_figure(edges, all_domains, start_domain, show_labels)
+    
+    """Export si demandé"""
+    if output_dir:
+        save_dns_exports(edges, all_domains, start_domain, output_dir, fig, formats)
+    
+    print(f"\n Ouverture du graphe ({G.number_of_nodes()} noeuds, {G.number_of_edges()} liens)...")
     plt.show()
     
-    return G
+    """La fenêtre est fermée, on libère la figure (et les caches du rendu)"""
+    plt.close(fig)
+    return _named_graph(G)
+
+
+def window_will_open(output_dir=None, show=True):
+    """Dit si draw_dns_graph va ouvrir une fenêtre, sinon il fait seulement les exports
+    pas de fenêtre sans écran, avec show=False, ou en batch (sortie redirigée) avec des
+    exports, où elle bloquerait la suite en attendant qu'on la ferme"""
+    if HEADLESS or not show:
+        return False
+    return not (output_dir and not sys.stdout.isatty())
 
 
-def export_to_dot(G, filepath, layer_colors, default_color):
-    """Exporte le graphe au format DOT (Graphviz)"""
+def draw_dns_graph(edges, all_domains, start_domain, output_dir=None,
+                   formats=DEFAULT_EXPORT_FORMATS, show_labels=None, show=True):
+    """Dessine le graphe DNS avec les données de l'exploration
+    formats c'est les exports voulus si output_dir est donné ('svg', 'png', 'dot')
+    show_labels voir build_dns_figure
+    show=False pour jamais ouvrir de fenêtre
+    sans écran on peut rien afficher, alors on fait juste les exports
+    Retourne le DiGraph networkx avec les noms de domaine comme noeuds, ou None si
+    aucune figure a été dessinée (pas de fenêtre et pas d'export, ou export DOT seul)"""
+    if not window_will_open(output_dir, show):
+        if output_dir:
+            return export_only(edges, all_domains, start_domain, output_dir, formats,
+                               show_labels)
+        if HEADLESS:
+            print("\n Pas d'écran disponible, graphe non affiché (utiliser --export)")
+        return None
+    
+    return render_interactive(edges, all_domains, start_domain, output_dir, formats,
+                              show_labels)
+
+
+def draw_dns_graph_in_background(edges, all_domains, start_domain, output_dir=None,
+                                 formats=DEFAULT_EXPORT_FORMATS, show_labels=None, show=True):
+    """Lance draw_dns_graph dans un processus à part pour pas bloquer le programme
+    pendant le rendu et les exports, retourne le processus (join() pour attendre la fin)"""
+    process = mp.Process(target=draw_dns_graph,
+                         args=(edges, all_domains, start_domain, output_dir, formats,
+                               show_labels, show))
+    process.start()
+    return process
+
+
+"""Morceaux du fichier DOT, préparés une seule fois"""
+_DOT_HEADER = (
+    'digraph DNS {\n'
+    '    bgcolor="#1a1a2e";\n'
+    '    node [style=filled, fontcolor=white, fontname="Arial", fontsize=12];\n'
+    '    edge [color="#666666"];\n'
+    '    rankdir=LR;\n'
+    '    overlap=false;\n'
+    '    splines=true;\n'
+    '    nodesep=0.5;\n'
+    '    ranksep=1.5;\n\n'
+)
+_DOT_NODE = '    "{}" [fillcolor="{}"];\n'.format
+_DOT_EDGE = '    "{}" -> "{}" [color="{}"];\n'.format
+
+"""Échappement des noms dans les chaines DOT, en une passe avec str.translate
+(le backslash aussi, sinon un nom qui finit par un backslash mange le guillemet de fin)"""
+_DOT_ESC = str.maketrans({'"': '\\"', '\\': '\\\\'})
+
+
+def export_to_dot(edges, all_domains, filepath, layer_colors, default_color):
+    """Exporte le graphe au format DOT (Graphviz)
+    directement depuis les données de l'exploration, sans passer par le graphe networkx"""
+    node_lines = [
+        _DOT_NODE(node.translate(_DOT_ESC), layer_colors.get(layer, default_color))
+        for node, layer in all_domains.items()
+    ]
+    
+    """dict.fromkeys pour virer les liens en double tout en gardant l'ordre"""
+    edge_lines = [
+        _DOT_EDGE(source.translate(_DOT_ESC), target.translate(_DOT_ESC),
+                  layer_colors.get(all_domains.get(source, 1), default_color))
+        for source, target in dict.fromkeys(edges)
+    ]
+    
+    """on écrit tout le fichier d'un coup"""
     with open(filepath, 'w', encoding='utf-8') as f:
-        f.write('digraph DNS {\n')
-        f.write('    bgcolor="#1a1a2e";\n')
-        f.write('    node [style=filled, fontcolor=white, fontname="Arial", fontsize=12];\n')
-        f.write('    edge [color="#666666"];\n')
-        f.write('    rankdir=LR;\n')
-        f.write('    overlap=false;\n')
-        f.write('    splines=true;\n')
-        f.write('    nodesep=0.5;\n')
-        f.write('    ranksep=1.5;\n\n')
-        
-        for node in G.nodes():
-            layer = G.nodes[node].get('layer', 1)
-            color = layer_colors.get(layer, default_color)
-            safe_node = node.replace('"', '\\"')
-            f.write(f'    "{safe_node}" [fillcolor="{color}"];\n')
-        
-        f.write('\n')
-        
-        for source, target in G.edges():
-            safe_source = source.replace('"', '\\"')
-            safe_target = target.replace('"', '\\"')
-            source_layer = G.nodes[source].get('layer', 1)
-            edge_color = layer_colors.get(source_layer, default_color)
-            f.write(f'    "{safe_source}" -> "{safe_target}" [color="{edge_color}"];\n')
-        
-        f.write('}\n')
+        f.write(_DOT_HEADER + ''.join(node_lines) + '\n' + ''.join(edge_lines) + '}\n')